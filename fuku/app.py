@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from .module import Module
 from .task import IGNORED_TASK_KWARGS
 from .utils import entity_already_exists
@@ -5,41 +7,65 @@ from .utils import entity_already_exists
 
 class App(Module):
     dependencies = ['cluster']
+    fast_commands = {
+        'ls': ('handle_list', [], {}),
+        'rm': ('handle_remove', ['name'], {}),
+        'sl': ('handle_select', ['name'], {}),
+        'hide': ('handle_hide', ['name'], {}),
+    }
 
     def __init__(self, **kwargs):
         super().__init__('app', **kwargs)
+        self._target_groups = None
 
     def add_arguments(self, parser):
         subp = parser.add_subparsers(help='app help')
 
-        p = subp.add_parser('ls', help='list applications')
-        p.set_defaults(app_handler=self.handle_list)
-
-        p = subp.add_parser('mk', help='add an app')
-        p.add_argument('name', metavar='NAME', help='app name')
-        p.set_defaults(app_handler=self.handle_make)
-
-        remp = subp.add_parser('rm', help='remove an app')
-        remp.add_argument('name', help='app name')
-        remp.set_defaults(app_handler=self.handle_remove)
-
-        p = subp.add_parser('sl', help='select an app')
-        p.add_argument('name', metavar='NAME', help='app name')
-        p.set_defaults(app_handler=self.handle_select)
-
-        p = subp.add_parser('run', help='run a command')
-        p.add_argument('image', metavar='IMAGE', help='image name')
-        p.add_argument('command', metavar='CMD', nargs='+', help='command to run')
-        p.set_defaults(app_handler=self.handle_run)
-
-        p = subp.add_parser('expose', help='expose to internet')
-        p.add_argument('name', metavar='NAME', help='app name')
-        p.add_argument('domains', metavar='DOMAINS', help='list of domain names', nargs='*')
-        p.set_defaults(app_handler=self.handle_expose)
-
-        p = subp.add_parser('hide', help='hide from internet')
-        p.add_argument('name', metavar='NAME', help='app name')
-        p.set_defaults(app_handler=self.handle_hide)
+        def build_list(subp):
+            p = subp.add_parser('ls', help='list applications')
+            p.set_defaults(app_handler=self.handle_list)
+
+        def build_make(subp):
+            p = subp.add_parser('mk', help='add an app')
+            p.add_argument('name', metavar='NAME', nargs='+', help='app name')
+            p.set_defaults(app_handler=self.handle_make)
+
+        def build_remove(subp):
+            remp = subp.add_parser('rm', help='remove an app')
+            remp.add_argument('name', help='app name')
+            remp.set_defaults(app_handler=self.handle_remove)
+
+        def build_select(subp):
+            p = subp.add_parser('sl', help='select an app')
+            p.add_argument('name', metavar='NAME', help='app name')
+            p.set_defaults(app_handler=self.handle_select)
+
+        def build_run(subp):
+            p = subp.add_parser('run', help='run a command')
+            p.add_argument('image', metavar='IMAGE', help='image name')
+            p.add_argument('command', metavar='CMD', nargs='+', help='command to run')
+            p.set_defaults(app_handler=self.handle_run)
+
+        def build_expose(subp):
+            p = subp.add_parser('expose', help='expose to internet')
+            p.add_argument('name', metavar='NAME', help='app name')
+            p.add_argument('domains', metavar='DOMAINS', help='list of domain names', nargs='*')
+            p.set_defaults(app_handler=self.handle_expose)
+
+        def build_hide(subp):
+            p = subp.add_parser('hide', help='hide from internet')
+            p.add_argument('name', metavar='NAME', help='app name')
+            p.set_defaults(app_handler=self.handle_hide)
+
+        self.add_lazy_parsers(subp, {
+            'ls': build_list,
+            'mk': build_make,
+            'rm': build_remove,
+            'sl': build_select,
+            'run': build_run,
+            'expose': build_expose,
+            'hide': build_hide,
+        })
 
     def handle_list(self, args):
         self.list()
@@ -50,12 +76,15 @@ class App(Module):
 
     def iter_apps(self):
         for gr in self.iter_target_groups():
-            yield gr['TargetGroupName'].rsplit('-', 1)[1]
+            yield gr['TargetGroupName'].rpartition('-')[2]
 
     def handle_make(self, args):
-        self.make(args.name)
+        if len(args.name) == 1:
+            self.make(args.name[0])
+        else:
+            self.make_many(args.name)
 
-    def make(self, name):
+    def make(self, name, select=True, vpc_id=None):
         self.use_context = False
 
         self.validate(name)
@@ -64,9 +93,30 @@ class App(Module):
             self.error(f'App "{name}" already exists')
             return
 
-        self.make_target_group(name)
+        self.make_target_group(name, vpc_id)
         self.make_task(name)
-        self.select(name)
+        if select:
+            self.select(name)
+
+    def make_many(self, names):
+        """ Make several apps at once. The AWS calls for each app are
+        independent, so they run in parallel. boto3 sessions and resources
+        aren't thread-safe, so every client the workers use is created, and
+        the VPC looked up, before any work starts. No app is selected
+        afterwards.
+        """
+        names = list(dict.fromkeys(names))
+        self.use_context = False
+        for name in names:
+            self.validate(name)
+            if self.get_target_group(name):
+                self.error(f'App "{name}" already exists')
+        ctx = self.get_context()
+        vpc_id = self.get_module('cluster').get_vpc(ctx['cluster']).id
+        for service in ('elbv2', 'ecr', 'ecs'):
+            self.get_boto_client(service)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda n: self.make(n, select=False, vpc_id=vpc_id), names))
 
     def handle_remove(self, args):
         self.remove(args.name)
@@ -85,11 +135,10 @@ class App(Module):
 
     def select(self, name):
         if name is not None:
-            for gr in self.iter_target_groups():
-                if name and gr['TargetGroupName'].endswith('-' + name):
-                    self.store_set('selected', name)
-                    self.clear_parent_selections()
-                    return
+            if name and name in set(self.iter_apps()):
+                self.store_set('selected', name)
+                self.clear_parent_selections()
+                return
             self.error(f'no app "{name}"')
         else:
             self.clear_parent_selections()
@@ -146,13 +195,14 @@ class App(Module):
 
 
 class EcsApp(App):
-    def make(self, name):
-        super().make(name)
-        self.make_target_group(name)
+    def make(self, name, select=True, vpc_id=None):
+        super().make(name, select, vpc_id)
+        self.make_target_group(name, vpc_id)
 
-    def make_target_group(self, name):
+    def make_target_group(self, name, vpc_id=None):
         ctx = self.get_context()
-        vpc_id = self.get_module('cluster').get_vpc(ctx['cluster']).id
+        if vpc_id is None:
+            vpc_id = self.get_module('cluster').get_vpc(ctx['cluster']).id
         alb_cli = self.get_boto_client('elbv2')
         alb_cli.create_target_group(
             Name=f'fuku-{ctx["cluster"]}-{name}',
@@ -163,11 +213,13 @@ class EcsApp(App):
                 'HttpCode': '200,301'
             }
         )
+        self._target_groups = None
 
     def remove_target_group(self, name):
         alb_cli = self.get_boto_client('elbv2')
         target_group = self.get_target_group(name)
         alb_cli.delete_target_group(TargetGroupArn=target_group['TargetGroupArn'])
+        self._target_groups = None
 
     def get_target_group(self, app=None):
         ctx = self.get_context()
@@ -183,14 +235,20 @@ class EcsApp(App):
             return None
 
     def iter_target_groups(self):
-        self.use_context = False
-        ctx = self.get_context()
-        paginate = self.get_boto_paginator('elbv2', 'describe_target_groups').paginate()
-        for gr in paginate.search(
-            'TargetGroups[?starts_with(TargetGroupName, `"fuku-{cluster}-"`)] '.format(**ctx) +
-            '| sort_by(@, &TargetGroupName)'
-        ):
-            yield gr
+        """ The listing is kept for the rest of the process; making or removing
+        a target group clears it.
+        """
+        if self._target_groups is None:
+            self.use_context = False
+            ctx = self.get_context()
+            paginate = self.get_boto_paginator('elbv2', 'describe_target_groups').paginate(
+                PaginationConfig={'PageSize': 400}
+            )
+            self._target_groups = list(paginate.search(
+                'TargetGroups[?starts_with(TargetGroupName, `"fuku-{cluster}-"`)] '.format(**ctx) +
+                '| sort_by(@, &TargetGroupName)'
+            ))
+        return iter(self._target_groups)
 
 
     def expose(self, name, domains):
@@ -1,5 +1,6 @@
 import argparse
 import logging
+import sys
 
 from colorama import Fore
 
@@ -8,6 +9,7 @@ from .db import get_default_db, save_db
 
 class Client(object):
     global_arguments = {('app', 'application'), ('pg', 'DB instance')}
+    log_levels = ('CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG')
 
     def __init__(self):
         self.modules = []
@@ -15,7 +17,7 @@ class Client(object):
         self.parser.add_argument(
             f'--log',
             help='Log level. Default: WARNING',
-            choices=('CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'),
+            choices=self.log_levels,
         )
 
         # global arguments
@@ -68,9 +70,43 @@ class Client(object):
             if mod.name in parent.dependencies:
                 yield mod
 
+    def fast_parse(self, argv):
+        """ Parse simple invocations without building any parsers. Returns
+        None if the full argparse parser is needed.
+        """
+        args = argparse.Namespace(log=None)
+        for arg, verbose_name in self.global_arguments:
+            setattr(args, arg, None)
+        ii = 0
+        while ii < len(argv) and argv[ii].startswith('--'):
+            opt, eq, value = argv[ii][2:].partition('=')
+            if opt not in vars(args):
+                return None
+            if not eq:
+                ii += 1
+                if ii == len(argv):
+                    return None
+                value = argv[ii]
+            setattr(args, opt, value)
+            ii += 1
+        if ii == len(argv) or (args.log and args.log not in self.log_levels):
+            return None
+        try:
+            mod = self.get_module(argv[ii])
+        except KeyError:
+            return None
+        mod_args = mod.fast_dispatch(argv[ii + 1:])
+        if mod_args is None:
+            return None
+        vars(args).update(vars(mod_args))
+        args.handler = mod.entry
+        return args
+
     def entry(self):
-        self.add_arguments()
-        self.args = self.parser.parse_args()
+        self.args = self.fast_parse(sys.argv[1:])
+        if self.args is None:
+            self.add_arguments()
+            self.args = self.parser.parse_args()
 
         # set the logging log level based on parsed arguments
         loglevel = vars(self.args).get('log') or 'WARNING'
@@ -1,22 +1,47 @@
+import argparse
 import json
 import logging
 import os
 import stat
 import sys
 import tempfile
+import threading
 import unicodedata
 from contextlib import contextmanager
 from string import Template
 
-import boto3
-
 from .db import get_rc_path
 from .runner import run
 
+# Clients are shared by all modules for the life of the process, keyed on
+# service, region and profile, so repeated calls reuse open connections.
+# Creating a client resets boto3's default session, which is not thread-safe,
+# so creation is serialised.
+_boto_clients = {}
+_boto_clients_lock = threading.Lock()
+
+
+def get_boto_config(max_attempts=10):
+    # boto3 and botocore are slow to import, so they are only imported once a
+    # command actually talks to AWS.
+    from botocore.config import Config
+    return Config(
+        tcp_keepalive=True,
+        retries={
+            'max_attempts': max_attempts,
+            'mode': 'adaptive'
+        }
+    )
+
 
 class Module(object):
     dependencies = []
 
+    # Subcommands that can be dispatched without argparse, mapped to the
+    # handler name, positional argument names ("?" suffix for optional) and
+    # defaults for any options; see `fast_dispatch`.
+    fast_commands = {}
+
     def __init__(self, name, db=None, client=None):
         self.name = name
         self.db = db
@@ -28,6 +53,52 @@ class Module(object):
     def add_arguments(self, parser):
         pass
 
+    def add_lazy_parsers(self, subp, builders):
+        """ Only build the subcommand parser named on the command line. Help
+        requests, or an unknown subcommand, build them all so argparse can
+        list the choices.
+        """
+        argv = sys.argv[1:]
+        if self.name not in argv:
+            return
+        if '-h' in argv or '--help' in argv:
+            wanted = None
+        else:
+            wanted = self.get_subcommand(argv)
+        if wanted in builders:
+            builders[wanted](subp)
+        else:
+            for build in builders.values():
+                build(subp)
+
+    def fast_dispatch(self, argv):
+        """ Build the namespace for a positional-only invocation of one of
+        `fast_commands`. Returns None whenever argparse is needed instead.
+        """
+        if not argv or argv[0] not in self.fast_commands:
+            return None
+        handler, names, defaults = self.fast_commands[argv[0]]
+        values = argv[1:]
+        if any(v.startswith('-') for v in values):
+            return None
+        required = [n for n in names if not n.endswith('?')]
+        if not len(required) <= len(values) <= len(names):
+            return None
+        args = argparse.Namespace(**defaults)
+        for name in names:
+            setattr(args, name.rstrip('?'), None)
+        for name, value in zip(names, values):
+            setattr(args, name.rstrip('?'), value)
+        setattr(args, f'{self.name}_handler', getattr(self, handler))
+        return args
+
+    def get_subcommand(self, argv):
+        args = argv[argv.index(self.name) + 1:]
+        for arg in args:
+            if not arg.startswith('-'):
+                return arg
+        return None
+
     def validate(self, name):
         for char in {'-', '_', ' ', '/'}:
             if char in name:
@@ -188,26 +259,37 @@ class Module(object):
                 value = value.get(p, None)
         return value
 
-    def setup_boto_session(self, ctx={}):
+    def get_boto_session_kwargs(self, ctx={}):
         ctx = self.get_context(ctx, use_context=False)
         kwargs = {}
         if 'region' in ctx:
             kwargs['region_name'] = ctx['region']
         if 'profile' in ctx:
             kwargs['profile_name'] = ctx['profile']
-        boto3.setup_default_session(**kwargs)
+        return kwargs
 
     def get_boto_resource(self, resource, ctx={}):
-        self.setup_boto_session(ctx)
-        return boto3.resource(resource)
-
-    def get_boto_client(self, resource, ctx={}):
-        self.setup_boto_session(ctx)
-        return boto3.client(resource)
+        import boto3
+        kwargs = self.get_boto_session_kwargs(ctx)
+        with _boto_clients_lock:
+            boto3.setup_default_session(**kwargs)
+            return boto3.resource(resource, config=get_boto_config())
+
+    def get_boto_client(self, resource, ctx={}, max_attempts=10):
+        kwargs = self.get_boto_session_kwargs(ctx)
+        key = (resource, kwargs.get('region_name'), kwargs.get('profile_name'), max_attempts)
+        with _boto_clients_lock:
+            if key not in _boto_clients:
+                import boto3
+                boto3.setup_default_session(**kwargs)
+                _boto_clients[key] = boto3.client(
+                    resource,
+                    config=get_boto_config(max_attempts)
+                )
+            return _boto_clients[key]
 
     def get_boto_paginator(self, client, resource, ctx={}):
-        self.setup_boto_session(ctx)
-        return boto3.client(client).get_paginator(resource)
+        return self.get_boto_client(client, ctx).get_paginator(resource)
 
     def puts3(self, key, value):
         ctx = self.get_context()
@@ -253,14 +335,16 @@ class Module(object):
 
     def get_secure_file(self, path):
         full_path = os.path.join(get_rc_path(), path)
-        if not os.path.exists(full_path):
+        mode = stat.S_IRUSR | stat.S_IWUSR
+        try:
+            st = os.stat(full_path)
+        except FileNotFoundError:
+            st = None
+        if st is None:
             data = self.gets3(f'{path}.gpg')
             if data is None:
                 self.error(f'no secure key file found: {path}')
-            try:
-                os.makedirs(os.path.dirname(full_path))
-            except OSError:
-                pass
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
             with open(f'{full_path}.gpg', 'wb') as file:
                 file.write(data)
             try:
@@ -268,7 +352,9 @@ class Module(object):
             except:
                 self.clear_secure_file(path)
                 raise
-            os.chmod(full_path, stat.S_IRUSR | stat.S_IWUSR)
+            os.chmod(full_path, mode)
+        elif stat.S_IMODE(st.st_mode) != mode:
+            os.chmod(full_path, mode)
         return full_path
 
     def clear_secure_file(self, path):
@@ -281,9 +367,6 @@ class Module(object):
     def get_my_context(self):
         return {}
 
-    def escape(self, value):
-        return value.replace('"', '\\"')
-
     def get_logger(self):
         logger = logging.getLogger(f'fuku.{self.name}')
         return logger
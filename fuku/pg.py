@@ -1,124 +1,175 @@
+import glob
+import json
 import os
 import re
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from pprint import pprint
-
-import botocore
+from pathlib import Path
 
 from .db import get_rc_path
 from .module import Module
-from .utils import gen_secret
+from .utils import gen_secret, hedged_call, print_json
+
+# Stored endpoints are trusted for a day; they only change on failover.
+ENDPOINT_TTL = 24 * 60 * 60
 
 
 class Pg(Module):
     dependencies = ['app']
+    fast_commands = {
+        'ls': ('handle_list', ['name?'], {}),
+        'connect': ('handle_connect', ['dbname'], {'task': None}),
+        'sl': ('handle_select', ['name?'], {}),
+        'psql': ('handle_psql', [], {'dbname': None, 'command': None}),
+        'dump': ('handle_dump', ['dbname', 'output'], {}),
+        'restore': ('handle_restore', ['dbname', 'input'], {}),
+        'rollback': ('handle_rollback', ['dbname', 'time'], {}),
+        'backup': ('handle_backup', ['dbname'], {'list': False}),
+        'share': ('handle_share', ['dbname', 'key'], {}),
+        'summary': ('handle_summary', [], {}),
+        'refresh': ('handle_refresh', ['name?'], {}),
+    }
 
     def __init__(self, **kwargs):
         super().__init__('pg', **kwargs)
+        self._endpoints = {}
+        self._pgpass = {}
 
     def add_arguments(self, parser):
         # ## SECTION FOR fuku pg ## #
         subp = parser.add_subparsers(help='pg help')
 
-        p = subp.add_parser('ls', help='list postgres DBs')
-        p.add_argument('name', metavar='NAME', nargs='?', help='DB name')
-        p.set_defaults(pg_handler=self.handle_list)
-
-        p = subp.add_parser('mk', help='add a postgres instance')
-        p.add_argument('name', metavar='NAME', help='instance name')
-        p.add_argument('--backup', '-b', default=7, type=int, help='number of days to retain backups')
-        p.add_argument('--storage', '-s', default=5, type=int, help='allocated storage (GB)')
-        p.set_defaults(pg_handler=self.handle_make)
-
-        # p = subp.add_parser('cache', help='cache instance details')
-        # p.add_argument('name', metavar='NAME', help='DB name')
-        # p.add_argument('password', metavar='PASSWORD', help='DB password')
-        # p.set_defaults(pg_handler=self.handle_cache)
-
-        p = subp.add_parser('connect', help='connect to a task')
-        p.add_argument('dbname', metavar='DBNAME', help='DB name')
-        p.add_argument('--task', '-t', help='target task name')
-        p.set_defaults(pg_handler=self.handle_connect)
-
-        p = subp.add_parser('sl', help='select a postgres DB')
-        p.add_argument('name', metavar='NAME', nargs='?', help='instance to select')
-        p.set_defaults(pg_handler=self.handle_select)
-
-        p = subp.add_parser('psql')
-        p.add_argument('--dbname', '-d', help='DB name')
-        p.add_argument('--command', '-c', help='run SQL')
-        p.set_defaults(pg_handler=self.handle_psql)
-
-        p = subp.add_parser('dump', help='dump contents of database')
-        p.add_argument('dbname', metavar='DBNAME', help='DB name')
-        p.add_argument('output', metavar='OUTPUT', help='output filename')
-        p.set_defaults(pg_handler=self.handle_dump)
-
-        p = subp.add_parser('restore', help='restore a database')
-        p.add_argument('dbname', metavar='DBNAME', help='DB name')
-        p.add_argument('input', metavar='INPUT', help='database dump file')
-        p.set_defaults(pg_handler=self.handle_restore)
-
-        p = subp.add_parser('rollback', help='rollback a database')
-        p.add_argument('dbname', metavar='DBNAME', help='DB name')
-        p.add_argument('time', metavar='TIME', help='rollback time')
-        p.set_defaults(pg_handler=self.handle_rollback)
-
-        p = subp.add_parser('backup', help='backup a database to S3')
-        p.add_argument('dbname', metavar='DBNAME', help='DB name')
-        p.add_argument('--list', action='store_true', help='list backups')
-        p.set_defaults(pg_handler=self.handle_backup)
-
-        p = subp.add_parser('share', help='share a backed up database')
-        p.add_argument('dbname', metavar='DBNAME', help='DB name')
-        p.add_argument('key', metavar='KEY', help='backup key')
-        p.set_defaults(pg_handler=self.handle_share)
-
-        p = subp.add_parser('summary', help='summarize databases')
-        p.set_defaults(pg_handler=self.handle_summary)
+        def build_list(subp):
+            p = subp.add_parser('ls', help='list postgres DBs')
+            p.add_argument('name', metavar='NAME', nargs='?', help='DB name')
+            p.set_defaults(pg_handler=self.handle_list)
+
+        def build_make(subp):
+            p = subp.add_parser('mk', help='add a postgres instance')
+            p.add_argument('name', metavar='NAME', help='instance name')
+            p.add_argument('--backup', '-b', default=7, type=int, help='number of days to retain backups')
+            p.add_argument('--storage', '-s', default=5, type=int, help='allocated storage (GB)')
+            p.set_defaults(pg_handler=self.handle_make)
+
+        # def build_cache(subp):
+        #     p = subp.add_parser('cache', help='cache instance details')
+        #     p.add_argument('name', metavar='NAME', help='DB name')
+        #     p.add_argument('password', metavar='PASSWORD', help='DB password')
+        #     p.set_defaults(pg_handler=self.handle_cache)
+
+        def build_connect(subp):
+            p = subp.add_parser('connect', help='connect to a task')
+            p.add_argument('dbname', metavar='DBNAME', help='DB name')
+            p.add_argument('--task', '-t', help='target task name')
+            p.set_defaults(pg_handler=self.handle_connect)
+
+        def build_select(subp):
+            p = subp.add_parser('sl', help='select a postgres DB')
+            p.add_argument('name', metavar='NAME', nargs='?', help='instance to select')
+            p.set_defaults(pg_handler=self.handle_select)
+
+        def build_psql(subp):
+            p = subp.add_parser('psql')
+            p.add_argument('--dbname', '-d', help='DB name')
+            p.add_argument('--command', '-c', help='run SQL')
+            p.set_defaults(pg_handler=self.handle_psql)
+
+        def build_dump(subp):
+            p = subp.add_parser('dump', help='dump contents of database')
+            p.add_argument('dbname', metavar='DBNAME', help='DB name')
+            p.add_argument('output', metavar='OUTPUT', help='output filename')
+            p.set_defaults(pg_handler=self.handle_dump)
+
+        def build_restore(subp):
+            p = subp.add_parser('restore', help='restore a database')
+            p.add_argument('dbname', metavar='DBNAME', help='DB name')
+            p.add_argument('input', metavar='INPUT', help='database dump file')
+            p.set_defaults(pg_handler=self.handle_restore)
+
+        def build_rollback(subp):
+            p = subp.add_parser('rollback', help='rollback a database')
+            p.add_argument('dbname', metavar='DBNAME', help='DB name')
+            p.add_argument('time', metavar='TIME', help='rollback time')
+            p.set_defaults(pg_handler=self.handle_rollback)
+
+        def build_backup(subp):
+            p = subp.add_parser('backup', help='backup a database to S3')
+            p.add_argument('dbname', metavar='DBNAME', help='DB name')
+            p.add_argument('--list', action='store_true', help='list backups')
+            p.set_defaults(pg_handler=self.handle_backup)
+
+        def build_share(subp):
+            p = subp.add_parser('share', help='share a backed up database')
+            p.add_argument('dbname', metavar='DBNAME', help='DB name')
+            p.add_argument('key', metavar='KEY', help='backup key')
+            p.set_defaults(pg_handler=self.handle_share)
+
+        def build_summary(subp):
+            p = subp.add_parser('summary', help='summarize databases')
+            p.set_defaults(pg_handler=self.handle_summary)
+
+        def build_refresh(subp):
+            p = subp.add_parser('refresh', help='forget stored DB endpoints')
+            p.add_argument('name', metavar='NAME', nargs='?', help='instance name')
+            p.set_defaults(pg_handler=self.handle_refresh)
 
         # ## SECTION FOR fuku pg db ## #
-        p = subp.add_parser('db', help='manage databases')
-        ssp = p.add_subparsers()
-
-        p = ssp.add_parser('ls')
-        p.set_defaults(pg_handler=self.handle_db_list)
-
-        p = ssp.add_parser('mk')
-        p.add_argument('dbname', metavar='DBNAME', help='DB name')
-        p.set_defaults(pg_handler=self.handle_db_make)
-
-        p = ssp.add_parser('rm')
-        p.add_argument('dbname', metavar='DBNAME', help='DB name')
-        p.set_defaults(pg_handler=self.handle_db_remove)
+        def build_db(subp):
+            p = subp.add_parser('db', help='manage databases')
+            ssp = p.add_subparsers()
+
+            p = ssp.add_parser('ls')
+            p.set_defaults(pg_handler=self.handle_db_list)
+
+            p = ssp.add_parser('mk')
+            p.add_argument('dbname', metavar='DBNAME', help='DB name')
+            p.set_defaults(pg_handler=self.handle_db_make)
+
+            p = ssp.add_parser('rm')
+            p.add_argument('dbname', metavar='DBNAME', help='DB name')
+            p.set_defaults(pg_handler=self.handle_db_remove)
+
+        self.add_lazy_parsers(subp, {
+            'ls': build_list,
+            'mk': build_make,
+            'connect': build_connect,
+            'sl': build_select,
+            'psql': build_psql,
+            'dump': build_dump,
+            'restore': build_restore,
+            'rollback': build_rollback,
+            'backup': build_backup,
+            'share': build_share,
+            'summary': build_summary,
+            'refresh': build_refresh,
+            'db': build_db,
+        })
 
     def handle_list(self, args):
         self.list(args.name)
 
     def list(self, name):
-        rds = self.get_boto_client('rds')
         if name:
+            rds = self.get_boto_client('rds')
             data = rds.describe_db_instances(
-                Filters=[{
-                    'Name': 'db-instance-id',
-                    'Values': [self.get_instance_id(name)]
-                }]
+                DBInstanceIdentifier=self.get_instance_id(name)
             )
-            pprint(data['DBInstances'][0])
+            print_json(data['DBInstances'][0])
         else:
             for dbinst in self.iter_db_instances():
                 print(dbinst)
 
     def iter_db_instances(self):
-        rds = self.get_boto_client('rds')
-        data = rds.describe_db_instances()
         ctx = self.get_context(use_context=False)
         pre = f'fuku-{ctx["cluster"]}-'
-        for db in data['DBInstances']:
-            name = db['DBInstanceIdentifier']
-            if name.startswith(pre):
-                yield name[len(pre):]
+        pre_len = len(pre)
+        paginate = self.get_boto_paginator('rds', 'describe_db_instances').paginate()
+        for name in paginate.search(
+            f'DBInstances[?starts_with(DBInstanceIdentifier, `"{pre}"`)].DBInstanceIdentifier'
+        ):
+            yield name[pre_len:]
 
     def handle_make(self, args):
         self.make(args.name, args.backup, args.storage)
@@ -156,13 +207,41 @@ class Pg(Module):
                 }
             ]
         )
-        waiter = rds.get_waiter('db_instance_available')
-        waiter.wait(
-            DBInstanceIdentifier=inst_id
-        )
-        self.cache(name, db_id, password)
+        # The endpoint is assigned well before the instance is available, so
+        # cache the credentials as soon as it appears; RDS carries on
+        # provisioning while we do. An available instance always has an
+        # endpoint, so this has run by the time the wait returns.
+        def cache(endpoint):
+            self._endpoints[name] = endpoint
+            self.cache(name, db_id, password)
+
+        self.wait_available(inst_id, on_endpoint=cache)
         self.select(name)
 
+    def wait_available(self, inst_id, on_endpoint=None, delay=2.0, max_delay=60, timeout=3600):
+        """ Poll quickly at first, then back off, rather than using the RDS
+        waiter's fixed 30 second interval. `on_endpoint` is called once, as
+        soon as the instance has an endpoint.
+        """
+        rds = self.get_boto_client('rds')
+        start = time.time()
+        while 1:
+            inst = rds.describe_db_instances(
+                DBInstanceIdentifier=inst_id
+            )['DBInstances'][0]
+            if on_endpoint and inst.get('Endpoint'):
+                on_endpoint(inst['Endpoint'])
+                on_endpoint = None
+            status = inst['DBInstanceStatus']
+            if status == 'available':
+                return
+            if status in ('deleted', 'deleting', 'failed', 'incompatible-parameters'):
+                self.error(f'instance "{inst_id}" is {status}')
+            if time.time() - start > timeout:
+                self.error(f'timed out waiting for instance "{inst_id}"')
+            time.sleep(delay)
+            delay = min(delay * 1.5, max_delay)
+
     def handle_db_list(self, args):
         self.db_list()
 
@@ -179,14 +258,15 @@ class Pg(Module):
         path = os.path.join(ctx['cluster'], f'{inst_name}.pgpass')
         path = self.get_secure_file(path)
         endpoint = self.get_endpoint(inst_name)
-        cmd = 'psql -h {} -p {} -U {} -d {}'.format(
-            endpoint['Address'],
-            endpoint['Port'],
-            inst_name,
-            'postgres'
-        )
         sql = 'SELECT datname FROM pg_database WHERE datistemplate = false;'
-        cmd = f'{cmd} -c "{sql}"'
+        cmd = [
+            'psql',
+            '-h', endpoint['Address'],
+            '-p', str(endpoint['Port']),
+            '-U', inst_name,
+            '-d', 'postgres',
+            '-c', sql
+        ]
         output = self.run(
             cmd,
             capture=True,
@@ -210,19 +290,16 @@ class Pg(Module):
         self.psql(command=f'GRANT rds_superuser TO {db_id}')
         data = self.get_endpoint(inst_name)
         path = os.path.join(self.get_rc_path(), ctx['app'], inst_name, f'{name}.pgpass')
-        try:
-            os.makedirs(os.path.dirname(path))
-        except OSError:
-            pass
-        with open(path, 'w') as outf:
-            outf.write('{}:{}:{}:{}:{}'.format(
-                data['Address'],
-                data['Port'],
-                db_id,
-                db_id,
-                password
-            ))
-        os.chmod(path, 0o600)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pgpass = Path(path)
+        pgpass.write_text('{}:{}:{}:{}:{}'.format(
+            data['Address'],
+            data['Port'],
+            db_id,
+            db_id,
+            password
+        ))
+        pgpass.chmod(0o600)
         self.encrypt_file(path, purpose='the database credentials')
         s3 = self.get_boto_client('s3')
         s3.upload_file(f'{path}.gpg', ctx['bucket'], f'fuku/{ctx["cluster"]}/{ctx["app"]}/{inst_name}/{name}.pgpass.gpg')
@@ -240,24 +317,32 @@ class Pg(Module):
 
     def cache(self, inst_name, db_name, password):
         ctx = self.get_context()
-        data = self.get_endpoint(inst_name)
         path = os.path.join(self.get_rc_path(), f'{inst_name}.pgpass')
-        try:
-            os.makedirs(os.path.dirname(path))
-        except OSError:
-            pass
-        with open(path, 'w') as outf:
-            outf.write('{}:{}:{}:{}:{}'.format(
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Look up the endpoint while preparing the directory, and store it
+            # locally while the encrypted file uploads.
+            endpoint = executor.submit(self.get_endpoint, inst_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = endpoint.result()
+            pgpass = Path(path)
+            pgpass.write_text('{}:{}:{}:{}:{}'.format(
                 data['Address'],
                 data['Port'],
                 db_name,
                 inst_name,
                 password
             ))
-        os.chmod(path, 0o600)
-        self.encrypt_file(path, purpose='the database credentials')
-        s3 = self.get_boto_client('s3')
-        s3.upload_file(f'{path}.gpg', ctx['bucket'], f'fuku/{ctx["cluster"]}/{inst_name}.pgpass.gpg')
+            pgpass.chmod(0o600)
+            self.encrypt_file(path, purpose='the database credentials')
+            s3 = self.get_boto_client('s3')
+            upload = executor.submit(
+                s3.upload_file,
+                f'{path}.gpg',
+                ctx['bucket'],
+                f'fuku/{ctx["cluster"]}/{inst_name}.pgpass.gpg'
+            )
+            self.save_endpoint(inst_name, data)
+            upload.result()
 
     def handle_connect(self, args):
         self.connect(args.dbname, args.task)
@@ -295,14 +380,15 @@ class Pg(Module):
             db_id = None
             path = os.path.join(self.get_rc_path(), f'{inst_name}.pgpass')
         endpoint = self.get_endpoint(inst_name)
-        cmd = 'psql -h {} -p {} -U {} -d {}'.format(
-            endpoint['Address'],
-            endpoint['Port'],
-            db_id or ctx['dbinstance'],
-            db_id or 'postgres'
-        )
+        cmd = [
+            'psql',
+            '-h', endpoint['Address'],
+            '-p', str(endpoint['Port']),
+            '-U', db_id or ctx['dbinstance'],
+            '-d', db_id or 'postgres'
+        ]
         if command:
-            cmd = f'{cmd} -c "{self.escape(command)}"'
+            cmd.extend(['-c', command])
         self.run(
             cmd,
             capture=False,
@@ -317,13 +403,14 @@ class Pg(Module):
         db_id, path = self.get_db_creds(db_name)
         endpoint = self.get_endpoint(ctx['dbinstance'])
         self.run(
-            'pg_dump -Fc -x -O -h {} -p {} -U {} -d {} -f {}'.format(
-                endpoint['Address'],
-                endpoint['Port'],
-                db_id,
-                db_id,
-                output
-            ),
+            [
+                'pg_dump', '-Fc', '-x', '-O',
+                '-h', endpoint['Address'],
+                '-p', str(endpoint['Port']),
+                '-U', db_id,
+                '-d', db_id,
+                '-f', output
+            ],
             capture=False,
             env={'PGPASSFILE': path}
         )
@@ -343,7 +430,14 @@ class Pg(Module):
         #     env={'PGPASSFILE': path}
         # )
         self.run(
-            f'pg_restore -x -O -c -h {endpoint["Address"]} -p {endpoint["Port"]} -U {db_id} -d {db_id} {input}',
+            [
+                'pg_restore', '-x', '-O', '-c',
+                '-h', endpoint['Address'],
+                '-p', str(endpoint['Port']),
+                '-U', db_id,
+                '-d', db_id,
+                input
+            ],
             capture=False,
             env={'PGPASSFILE': path}
         )
@@ -370,6 +464,7 @@ class Pg(Module):
         self.backup(args.dbname, args.list)
 
     def backup(self, db_name, list):
+        import botocore.exceptions
         ctx = self.get_context()
         if list:
             pre = 'backups/{}/{}/'.format(
@@ -437,6 +532,17 @@ class Pg(Module):
         )
         print(r)
 
+    def handle_refresh(self, args):
+        self.refresh(args.name)
+
+    def refresh(self, name=None):
+        if name:
+            self.clear_endpoint(name)
+        else:
+            self._endpoints = {}
+            for path in glob.glob(self.get_endpoint_path('*')):
+                os.remove(path)
+
     def handle_summary(self, args):
         self.summary()
 
@@ -461,14 +567,63 @@ class Pg(Module):
         return os.path.join(get_rc_path(), ctx['cluster'])
 
     def get_endpoint(self, name):
-        inst_id = self.get_instance_id(name)
-        rds = self.get_boto_client('rds')
+        """ Endpoints only change on failover, so they are stored on disk for
+        `ENDPOINT_TTL` seconds and RDS is asked at most once per process.
+        Use `fuku pg refresh` to forget a stale endpoint.
+        """
+        if name in self._endpoints:
+            return self._endpoints[name]
+        endpoint = self.load_endpoint(name)
+        if endpoint is None:
+            import botocore.exceptions
+            inst_id = self.get_instance_id(name)
+            try:
+                endpoint = self.describe_instance(inst_id)['DBInstances'][0]['Endpoint']
+            except (botocore.exceptions.ClientError, IndexError, KeyError):
+                self.clear_endpoint(name)
+                self.error(f'no database "{name}"')
+            self.save_endpoint(name, endpoint)
+        self._endpoints[name] = endpoint
+        return endpoint
+
+    def describe_instance(self, inst_id):
+        """ Only single attempts are hedged, so a throttled request never
+        starts a second retry chain. If both attempts fail, the normal client
+        retries with backoff.
+        """
+        import botocore.exceptions
+        rds = self.get_boto_client('rds', max_attempts=1)
         try:
-            return rds.describe_db_instances(
-                DBInstanceIdentifier=inst_id
-            )['DBInstances'][0]['Endpoint']
-        except:
-            self.error(f'no database "{name}"')
+            return hedged_call(rds.describe_db_instances, DBInstanceIdentifier=inst_id)
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError):
+            rds = self.get_boto_client('rds')
+            return rds.describe_db_instances(DBInstanceIdentifier=inst_id)
+
+    def get_endpoint_path(self, name):
+        return os.path.join(self.get_rc_path(), f'{name}.endpoint.json')
+
+    def load_endpoint(self, name):
+        try:
+            with open(self.get_endpoint_path(name), 'r') as inf:
+                data = json.load(inf)
+        except (OSError, ValueError):
+            return None
+        if time.time() - data.get('fetched_at', 0) > ENDPOINT_TTL:
+            return None
+        return data['endpoint']
+
+    def save_endpoint(self, name, endpoint):
+        path = self.get_endpoint_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as outf:
+            json.dump({'endpoint': endpoint, 'fetched_at': time.time()}, outf)
+
+    def clear_endpoint(self, name):
+        self._endpoints.pop(name, None)
+        try:
+            os.remove(self.get_endpoint_path(name))
+        except OSError:
+            pass
 
     def get_instance(self, inst_name):
         rds = self.get_boto_client('rds')
@@ -481,13 +636,16 @@ class Pg(Module):
 
     def get_url(self, db_name):
         ctx = self.get_context()
-        path = os.path.join(self.get_rc_path(), ctx['app'], ctx['dbinstance'], f'{db_name}.pgpass')
-        try:
-            with open(path, 'r') as inf:
-                data = inf.read()
-        except:
-            self.error(f'no cached information for "{db_name}"')
-        host, port, db, user, pw = data.split(':')
+        key = (ctx['app'], ctx['dbinstance'], db_name)
+        if key not in self._pgpass:
+            path = os.path.join(self.get_rc_path(), ctx['app'], ctx['dbinstance'], f'{db_name}.pgpass')
+            try:
+                with open(path, 'r') as inf:
+                    host, port, db, user, pw = inf.read().split(':')
+            except (OSError, ValueError):
+                self.error(f'no cached information for "{db_name}"')
+            self._pgpass[key] = (host, port, db, user, pw)
+        host, port, db, user, pw = self._pgpass[key]
         return 'postgres://{}:{}@{}:{}/{}'.format(user, pw, host, port, db)
 
     # def get_pgpass_file(self, name):
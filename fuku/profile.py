@@ -1,8 +1,6 @@
 import os
 from configparser import ConfigParser
 
-import boto3
-
 from .module import Module
 from .utils import entity_already_exists, limit_exceeded
 
@@ -90,6 +88,7 @@ class Profile(Module):
         return cfg.sections()
 
     def create_ec2_role(self, user):
+        import boto3
         role_name = 'ec2-role'
         inst_name = 'ec2-profile'
         iam = boto3.Session(profile_name=user).client('iam')
@@ -107,6 +106,7 @@ class Profile(Module):
 
     def create_role(self, user, name, policies=[], iam=None):
         if iam is None:
+            import boto3
             iam = boto3.Session(profile_name=user).client('iam')
         with entity_already_exists():
             iam.create_role(
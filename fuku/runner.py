@@ -53,11 +53,18 @@ def local(command, capture=False, shell=None, ignore_errors=False, env=None):
         Changed the default value of ``capture`` from ``True`` to ``False``.
     .. versionadded:: 1.9
         The return value attributes ``.command`` and ``.real_command``.
+
+    ``command`` may also be a list of arguments, in which case it is executed
+    directly rather than through a shell, and no prefixes are applied.
     """
     given_command = command
-    # Apply cd(), path() etc
-    with_env = _prefix_env_vars(command, local=True)
-    wrapped_command = _prefix_commands(with_env, 'local')
+    use_shell = not isinstance(command, (list, tuple))
+    if use_shell:
+        # Apply cd(), path() etc
+        with_env = _prefix_env_vars(command, local=True)
+        wrapped_command = _prefix_commands(with_env, 'local')
+    else:
+        wrapped_command = list(command)
     # if output.debug:
     #     print("[localhost] local: %s" % (wrapped_command))
     # elif output.running:
@@ -76,9 +83,12 @@ def local(command, capture=False, shell=None, ignore_errors=False, env=None):
     if env is None:
         env = os.environ
     try:
-        cmd_arg = wrapped_command if win32 else [wrapped_command]
-        p = subprocess.Popen(cmd_arg, shell=True, stdout=out_stream,
-                             stderr=err_stream, executable=shell,
+        if use_shell:
+            cmd_arg = wrapped_command if win32 else [wrapped_command]
+        else:
+            cmd_arg = wrapped_command
+        p = subprocess.Popen(cmd_arg, shell=use_shell, stdout=out_stream,
+                             stderr=err_stream, executable=shell if use_shell else None,
                              close_fds=(not win32),
                              env=env)
         (stdout, stderr) = p.communicate()
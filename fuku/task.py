@@ -1,8 +1,6 @@
 import json
 import time
 
-import botocore
-
 from .module import Module
 from .utils import (
     StoreKeyValuePair,
@@ -176,6 +174,7 @@ class Task(Module):
             Deregisters a given task definiton ARN.
             If it fails due to ThrottlingException, wait 10 seconds and retry.
         '''
+        import botocore.exceptions
         ecs_cli = self.get_boto_client('ecs')
 
         paginator = ecs_cli.get_paginator('list_task_definitions')
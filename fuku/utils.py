@@ -1,11 +1,13 @@
 import argparse
+import json
+import queue
 import random
 import string
+import sys
+import threading
 from contextlib import contextmanager
 from datetime import datetime
 
-import botocore
-
 
 class EntityAlreadyExists(Exception):
     pass
@@ -137,6 +139,7 @@ def gen_name(length=16):
 
 @contextmanager
 def entity_already_exists(hide=True):
+    import botocore.exceptions
     try:
         yield
     except botocore.exceptions.ClientError as e:
@@ -155,6 +158,7 @@ def entity_already_exists(hide=True):
 
 @contextmanager
 def limit_exceeded():
+    import botocore.exceptions
     try:
         yield
     except botocore.exceptions.ClientError as e:
@@ -162,8 +166,58 @@ def limit_exceeded():
             raise
 
 
+def hedged_call(fn, *args, expected_ms=300, **kwargs):
+    """ Call `fn`, issuing a duplicate call if the first hasn't returned
+    within `expected_ms`. The first successful result wins. Attempts run on
+    daemon threads so a straggler never holds up process exit. Only use this
+    for idempotent, read-only, single-request calls.
+    """
+    results = queue.Queue()
+
+    def attempt():
+        try:
+            results.put((True, fn(*args, **kwargs)))
+        except BaseException as e:
+            results.put((False, e))
+
+    def start():
+        threading.Thread(target=attempt, daemon=True).start()
+
+    start()
+    pending = 1
+    try:
+        outcome = results.get(timeout=expected_ms / 1000)
+    except queue.Empty:
+        start()
+        pending += 1
+        outcome = results.get()
+    while 1:
+        pending -= 1
+        ok, value = outcome
+        if ok:
+            return value
+        if not pending:
+            raise value
+        outcome = results.get()
+
+
 def json_serial(obj):
     if isinstance(obj, datetime):
         serial = obj.isoformat()
         return serial
     raise TypeError('type not serializable')
+
+
+def print_json(data):
+    """ Print `data` as indented JSON, using orjson's encoder when it is
+    installed.
+    """
+    try:
+        import orjson
+    except ImportError:
+        print(json.dumps(data, default=json_serial, indent=2))
+        return
+    sys.stdout.flush()
+    sys.stdout.buffer.write(orjson.dumps(data, default=json_serial, option=orjson.OPT_INDENT_2))
+    sys.stdout.buffer.write(b'\n')
+    sys.stdout.flush()